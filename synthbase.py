@@ -1,9 +1,19 @@
+import functools
 import math
+import numpy as np
 import pygame
 
+try:
+    from numba import njit
+except ImportError:
+    # numba is optional - without it the kernels below are just plain python functions
+    def njit(*args, **kwargs):
+        return lambda f: f
+
 # MODULE SYSTEM
 
 class Input:
+    __slots__ = ("module", "name", "type", "default", "connection") # these exist per input per module - keep them dict-free
     def __init__(self, module, name, _type, default):
         self.module = module
         self.name = name
@@ -14,14 +24,17 @@ class Input:
             raise Exception(f"default value '{default}' is not of declared type ({_type})")
 
 class Output:
+    __slots__ = ("module", "name", "type", "value", "version", "connections")
     def __init__(self, module, name, _type):
         self.module = module
         self.name = name
         self.type = _type
         self.value = None
-        self.connections = set() # we need to be able to follow connections both ways to extricate deleted modules
+        self.version = 0 # bumped whenever value actually changes, so downstream modules can tell
+        self.connections = [] # we need to be able to follow connections both ways to extricate deleted modules
 
 class Setting:
+    __slots__ = ("module", "name", "default", "value")
     def __init__(self, module, name, default):
         self.module = module
         self.name = name
@@ -31,66 +44,278 @@ class Setting:
             raise Exception(f"default value '{default}' is not of declared type ({_type})")
 
 class Module:
+    # the class-level inputs/outputs/settings dicts are declarations - gen_widgets replaces them
+    # with instance-level dicts of Input/Output/Setting objects
     inputs = {}
     outputs = {}
     settings = {}
-    current_values = {}
+    # the declarations frozen into tuples, once per class rather than once per instance
+    _input_spec = ()
+    _output_spec = ()
+    _setting_spec = ()
     name = "[module]"
     error = None
+    depends_on_t = True # modules whose f ignores t can set this False to be memoized while their inputs hold still
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._input_spec = tuple((name, _type, default) for name, (_type, default) in cls.inputs.items())
+        cls._output_spec = tuple(cls.outputs.items())
+        cls._setting_spec = tuple(cls.settings.items())
     def __init__(self, synth):
         self.synth = synth
+        self.current_values = {} # was shared at class level, which aliased it across every module
+        self.error = None
+        self._settings_version = 0
+        self._memo_key = None
+        self._memo_outputs = None
+        self._seen_versions = None
+        self._fallback_bufs = None
+        self._fallback_len = 0
         self.gen_widgets()
     def gen_widgets(self):
-        self.inputs = {name: Input(self, name, _type, default) for name,(_type,default) in self.inputs.items()}
-        self.outputs = {name: Output(self, name, _type) for name,_type in self.outputs.items()}
-        self.settings = {name: Setting(self, name, _type, default) for name,(_type,default) in self.settings.items()}
+        self.inputs = {name: Input(self, name, _type, default) for name, _type, default in self._input_spec}
+        self.outputs = {name: Output(self, name, _type) for name, _type in self._output_spec}
+        self.settings = {name: Setting(self, name, _type, default) for name, (_type, default) in self._setting_spec}
+        self._regen_live_inputs()
     def connect_from(self, input_name, other_module, output_name):
         if isinstance(other_module, Module):
             self.inputs[input_name].connection = other_module.outputs[output_name]
-            other_module.outputs[output_name].connections.add(self.inputs[input_name])
+            if self.inputs[input_name] not in other_module.outputs[output_name].connections:
+                other_module.outputs[output_name].connections.append(self.inputs[input_name])
+            self._regen_live_inputs()
+            self.synth.graph_changed()
         else:
             raise Exception(f"not a module: '{other_module}' ({type(other_module)})")
     def disconnect(self, input_name):
         if self.inputs[input_name].connection is not None:
             self.inputs[input_name].connection.connections.remove(self.inputs[input_name])
             self.inputs[input_name].connection = None
+            self._regen_live_inputs()
+            self.synth.graph_changed()
+    def _regen_live_inputs(self):
+        # the (name, source output) pairs the scheduler needs every sample only change on
+        # connect/disconnect, so they're kept here rather than rederived by chasing
+        # input -> connection -> value attribute chains per tick
+        self._live_inputs = [(_input.name, _input.connection) for _input in self.inputs.values() if _input.connection is not None]
+        # the outputs as a flat tuple too, for run()'s end-of-frame sweep
+        self._output_items = tuple(self.outputs.items())
+        # one reusable kwargs dict per module - the scheduler overwrites the connected entries in
+        # place each tick, everything else stays at its default, so no dicts are built per sample
+        self._kwargs = {name: _input.default for name, _input in self.inputs.items()}
+        self._regen_invoke()
+    def _regen_invoke(self):
+        # codegen a specialised invoke per module: the connected outputs are closed over and read
+        # as straight-line statements, instead of the scheduler looping (name, output) tuples per
+        # tick. regenerated whenever connections change; anything going wrong just disables it
+        try:
+            names = [f"_o{i}" for i in range(len(self._live_inputs))]
+            lines = ["def _make(module, kwargs, outputs):",
+                     "    invoke = module.invoke",
+                     "    invoke_block = module.invoke_block"]
+            if names:
+                lines.append("    " + ", ".join(names) + ("," if len(names) == 1 else "") + " = outputs")
+            body = [f"        kwargs[{name!r}] = {var}.value" for (name, _), var in zip(self._live_inputs, names)]
+            lines += ["    def _invoke(t):"] + body + ["        return invoke(kwargs, t)"]
+            lines += ["    def _invoke_block(t):"] + body + ["        return invoke_block(kwargs, t)"]
+            lines.append("    return _invoke, _invoke_block")
+            namespace = {}
+            exec("\n".join(lines), namespace)
+            self._invoke, self._invoke_block = namespace["_make"](self, self._kwargs, [output for _, output in self._live_inputs])
+        except Exception:
+            self._invoke = None
+            self._invoke_block = None
+    def _inputs_changed(self):
+        # true when any source output (or our own settings) have a version we haven't seen yet
+        current = (self._settings_version,) + tuple(output.version for _, output in self._live_inputs)
+        if current != self._seen_versions:
+            self._seen_versions = current
+            return True
+        return False
+    def _memo_key_for(self, overall_inputs, extra):
+        # a hashable summary of everything a t-independent module's outputs can depend on, or None if one can't be built
+        try:
+            key = (self._settings_version, extra) + tuple(overall_inputs[k] for k in self.inputs)
+            hash(key)
+            return key
+        except TypeError: # unhashable inputs (e.g. a whole block's array) aren't worth keying on
+            return None
     def invoke(self, inputs, t):
-        overall_inputs = {k:(inputs[k] if k in inputs else self.inputs[k].default) for k in self.inputs}
+        # inputs must cover every declared input (the scheduler passes the prebuilt _kwargs dict)
+        key = None if self.depends_on_t else self._memo_key_for(inputs, None)
+        if key is not None and key == self._memo_key:
+            return self._memo_outputs
+        self.error = None
+        try:
+            outputs = self.f(t = t, **inputs)
+        except Exception as e:
+            self.error = e
+            outputs = {}
+        for name, value in outputs.items():
+            output = self.outputs[name]
+            if isinstance(value, np.ndarray) or value != output.value:
+                output.version += 1
+            output.value = value
+        if key is not None and self.error is None:
+            self._memo_key = key
+            self._memo_outputs = outputs
+        else:
+            self._memo_key = None
+        return outputs
+    def invoke_block(self, inputs, t):
+        # like invoke, but t is a numpy array of sample times and input/output values are arrays of the same length
+        key = None if self.depends_on_t else self._memo_key_for(inputs, len(t))
+        if key is not None and key == self._memo_key:
+            return self._memo_outputs
         self.error = None
         try:
-            outputs = self.f(t = t, **overall_inputs)
+            outputs = self.f_block(t = t, **inputs)
         except Exception as e:
             self.error = e
             outputs = {}
-        for output, value in outputs.items():
-            self.outputs[output].value = value
+        for name, value in outputs.items():
+            output = self.outputs[name]
+            if isinstance(value, np.ndarray) or value != output.value:
+                output.version += 1
+            output.value = value
+        if key is not None and self.error is None:
+            self._memo_key = key
+            self._memo_outputs = outputs
+        else:
+            self._memo_key = None
+        return outputs
     def destroy(self):
         for output in self.outputs.values():
-            for connection in set(output.connections): # need to copy output.connections so we don't alter its size while iterating over it
+            while output.connections: # disconnect pops entries, so just drain from the back
+                connection = output.connections[-1]
                 connection.module.disconnect(connection.name)
     def setting_changed(self):
-        pass # for settings to signal when they've been changed, in case we need to do something about that like only processing them after they're changed for performance reasons
+        # for settings to signal when they've been changed, in case we need to do something about that
+        # like only processing them after they're changed for performance reasons.
+        # overrides should call super().setting_changed() so the memoization above notices the change
+        self._settings_version += 1
+    def on_frame_start(self, block_len):
+        # called once per visual frame before the block is processed - a place for modules to do
+        # housekeeping (buffer resizes etc) that shouldn't be re-checked every sample
+        pass
     def f(self, t, **inputs):
         print("Module.f must be shadowed with a function that does the operations of the module, taking named arguments for all the inputs plus a time t and returning a dict of output values")
+    def f_block(self, t, **inputs):
+        # fallback block implementation that just calls the scalar f once per sample.
+        # modules whose f is stateless numeric code should shadow this with real vectorised numpy code instead.
+        # output arrays are preallocated per module and reused between blocks of the same length,
+        # rather than growing python lists and converting - safe because nothing keeps a block's
+        # array past the frame (run() scalarises output values at the end of each one)
+        n = len(t)
+        if self._fallback_bufs is None or self._fallback_len != n:
+            self._fallback_bufs = {name: np.empty(n, dtype = _type if _type in (float, int, bool) else object)
+                                   for name, _type in self._output_spec}
+            self._fallback_len = n
+        bufs = self._fallback_bufs
+        produced = None
+        for i in range(n):
+            sample_inputs = {k: (v[i] if isinstance(v, np.ndarray) else v) for k,v in inputs.items()}
+            values = self.f(t = t[i], **sample_inputs)
+            for name, value in values.items():
+                bufs[name][i] = value
+            if produced is None:
+                produced = tuple(values)
+        return {name: bufs[name] for name in (produced or ())}
 
 class Synth:
-    modules = set()
     def __init__(self, rate = 10):
         self.rate = rate
+        # a list (plus an index map for O(1) removal) rather than a set - iteration order is
+        # deterministic and removal is a swap-pop instead of a rehash
+        self.modules = []
+        self._module_index = {}
+        self._order = None
+        # the block time vector and the 0..n-1 ramp it's built from, reused across frames
+        self._t_buf = None
+        self._t_ramp = None
     def create_module(self, module):
         m = module(self)
-        self.modules.add(m)
+        self._module_index[m] = len(self.modules)
+        self.modules.append(m)
+        self.graph_changed()
         return m
     def remove_module(self, module):
-        if module in self.modules:
-            self.modules.remove(module)
+        if module in self._module_index:
+            index = self._module_index.pop(module)
+            last = self.modules.pop()
+            if last is not module:
+                self.modules[index] = last
+                self._module_index[last] = index
             module.destroy()
+            self.graph_changed()
+    def graph_changed(self):
+        # called whenever modules or connections change, so the cached evaluation order goes stale
+        self._order = None
+    def _evaluation_order(self):
+        # modules sorted so sources are processed before the modules that read from them, cached
+        # until the graph changes. cycles are fine - they just read the previous value at the seam
+        if self._order is None:
+            # iterative DFS so a long chain of modules can't hit the recursion limit
+            order = []
+            visited = set()
+            for root in self.modules:
+                if root in visited:
+                    continue
+                stack = [(root, False)]
+                while stack:
+                    module, expanded = stack.pop()
+                    if expanded:
+                        order.append(module)
+                        continue
+                    if module in visited:
+                        continue
+                    visited.add(module)
+                    stack.append((module, True))
+                    for _, output in module._live_inputs:
+                        if output.module in self._module_index and output.module not in visited:
+                            stack.append((output.module, False))
+            self._order = order
+        return self._order
     def step(self, t):
-        for module in self.modules:
-            module.current_values = module.invoke({_input.name:_input.connection.value for _input in module.inputs.values() if _input.connection is not None}, t)
+        for module in self._evaluation_order():
+            if module.depends_on_t or module._inputs_changed():
+                if module._invoke is not None:
+                    module.current_values = module._invoke(t)
+                else: # generic path, in case codegen failed
+                    kwargs = module._kwargs
+                    for name, output in module._live_inputs:
+                        kwargs[name] = output.value
+                    module.current_values = module.invoke(kwargs, t)
     def run(self, n, t_from, t_to):
-        for i in range(n):
-            self.step(t_from + ((t_to/n)*i))
+        # process all n samples as one numpy block through each module, rather than stepping
+        # the whole graph once per sample - the python-level overhead per sample was dominating
+        if n < 1:
+            return
+        # one shared time vector, refilled in place each frame rather than reallocated -
+        # modules treat t as read-only and nothing derived from it outlives the frame
+        if self._t_buf is None or len(self._t_buf) != n:
+            self._t_ramp = np.arange(n, dtype = float)
+            self._t_buf = np.empty(n)
+        t = self._t_buf
+        np.multiply(self._t_ramp, t_to/n, out = t)
+        t += t_from
+        for module in self.modules:
+            module.on_frame_start(n)
+        for module in self._evaluation_order():
+            if module.depends_on_t or module._inputs_changed():
+                if module._invoke_block is not None:
+                    module._invoke_block(t)
+                else: # generic path, in case codegen failed
+                    kwargs = module._kwargs
+                    for name, output in module._live_inputs:
+                        kwargs[name] = output.value
+                    module.invoke_block(kwargs, t)
+        for module in self.modules:
+            # between blocks only the most recent sample is kept, so the interface layer sees plain scalars
+            cv = module.current_values
+            for name, output in module._output_items:
+                if isinstance(output.value, np.ndarray) and len(output.value) > 0:
+                    output.value = output.value[-1]
+                cv[name] = output.value
 
 
 class RepeatCounter:
@@ -99,24 +324,50 @@ class RepeatCounter:
     # this is because we don't know the value of t during instantiation
     def __init__(self, rate):
         self.rate = rate # in hz
-        self.t_last_repeat = 0
+        self.t_last_repeat = None # None until the first call tells us what time it is
     def repeats(self, t):
-        self.t_last_repeat = t
-        self.repeats = self.real_repeats
-        return 0
-    def real_repeats(self, t):
+        if self.t_last_repeat is None:
+            self.t_last_repeat = t
+            return 0
         if self.rate > 0:
-            delta_t = t - self.t_last_repeat
-            repetitions = int(delta_t * self.rate)
-            self.t_last_repeat += (repetitions/self.rate)
+            repetitions = int((t - self.t_last_repeat) * self.rate)
+            self.t_last_repeat += repetitions/self.rate
             return repetitions
-        else:
-            return 0
+        return 0
 
 
 # VISUAL INTERFACE
 
-pygame.init()
+def _ensure_pygame():
+    # sdl init is deferred to the first VisualSynth, so importing the module for the pure
+    # compute layer (headless tools, tests) doesn't pay video/audio subsystem startup
+    if not pygame.get_init():
+        pygame.init()
+
+# rendered text surfaces are cached - font.render is one of the slowest pygame calls
+# and the same strings come up frame after frame
+_text_cache = {}
+def cached_render(font, text, color):
+    key = (id(font), text, color)
+    surface = _text_cache.get(key)
+    if surface is None:
+        if len(_text_cache) > 512: # crude cap so interactively edited text can't grow the cache forever
+            _text_cache.clear()
+        surface = font.render(text, True, color)
+        _text_cache[key] = surface
+    return surface
+
+# same idea for measurements - font.size calls into sdl_ttf and the same strings recur
+_size_cache = {}
+def cached_size(font, text):
+    key = (id(font), text)
+    size = _size_cache.get(key)
+    if size is None:
+        if len(_size_cache) > 512:
+            _size_cache.clear()
+        size = font.size(text)
+        _size_cache[key] = size
+    return size
 
 class VisualInput(Input):
     def __init__(self, *args, **kwargs):
@@ -125,7 +376,20 @@ class VisualInput(Input):
     def draw(self, surface):
         x,y,w,h = self.get_rect()
         pygame.draw.circle(surface, (100,200,100), (x + (w/2), y + (h/2)), min(w,h)*0.4, 3)
+    def on_click(self, synth):
+        # second click of a pending connection, or the start of one from this input
+        if synth.connecting:
+            if isinstance(synth.connecting, VisualOutput):
+                if self.connection == synth.connecting:
+                    self.module.disconnect(self.name)
+                else:
+                    self.module.connect_from(self.name, synth.connecting.module, synth.connecting.name)
+            synth.connecting = None
+        else:
+            synth.connecting = self
     def get_rect(self):
+        return self._rect
+    def compute_rect(self):
         return (0, 30 + (self.index * 20), 20, 20)
 
 class VisualOutput(Output):
@@ -135,7 +399,19 @@ class VisualOutput(Output):
     def draw(self, surface):
         x,y,w,h = self.get_rect()
         pygame.draw.circle(surface, (200,100,100), (x + (w/2), y + (h/2)), min(w,h)*0.4, 3)
+    def on_click(self, synth):
+        if synth.connecting:
+            if isinstance(synth.connecting, VisualInput):
+                if synth.connecting.connection == self:
+                    synth.connecting.module.disconnect(synth.connecting.name)
+                else:
+                    synth.connecting.module.connect_from(synth.connecting.name, self.module, self.name)
+            synth.connecting = None
+        else:
+            synth.connecting = self
     def get_rect(self):
+        return self._rect
+    def compute_rect(self):
         return (self.module.w - 20, 30 + (self.index * 20), 20, 20)
 
 class VisualEnumSetting(Setting):
@@ -152,17 +428,29 @@ class VisualEnumSetting(Setting):
     def draw(self, surface):
         x,y,w,h = self.get_rect()
         pygame.draw.rect(surface, (70,70,70), pygame.Rect(x, y+2, w, h-4))
-        value_text = self.module.synth.smallfont.render(str(self.value), True, (250,250,250))
+        value_text = cached_render(self.module.synth.smallfont, str(self.value), (250,250,250))
         surface.blit(value_text, (x+5,y+4))
+    _menu_surface = None
+    _menu_w = None
     def draw_menu(self, surface):
         x,y,w,h = self.get_rect()
         x += self.module.x
         y += self.module.y
-        pygame.draw.rect(surface, (70, 70, 70), pygame.Rect(x-2, y, w+4, h * len(self.options)))
-        for i in range(len(self.options)):
-            pygame.draw.rect(surface, (100,100,100), pygame.Rect(x, (20*i) + y+2, w, h-4))
-            value_text = self.module.synth.smallfont.render(str(self.options[i]), True, (250,250,250))
-            surface.blit(value_text, (x + 5, (20*i) + y + 4))
+        # the open menu is static apart from its position, so it's rendered once to its own
+        # surface (rebuilt if the widget width changes) and blitted per frame
+        if self._menu_surface is None or self._menu_w != w:
+            menu = pygame.Surface((w+4, h * len(self.options)))
+            menu.fill((70, 70, 70))
+            for i in range(len(self.options)):
+                pygame.draw.rect(menu, (100,100,100), pygame.Rect(2, (20*i) + 2, w, h-4))
+                value_text = cached_render(self.module.synth.smallfont, str(self.options[i]), (250,250,250))
+                menu.blit(value_text, (7, (20*i) + 4))
+            self._menu_surface = menu
+            self._menu_w = w
+        surface.blit(self._menu_surface, (x-2, y))
+    def on_click(self, synth):
+        if not synth.connecting:
+            synth.menu_open = self
     def menu_click(self, pos):
         x,y,w,h = self.get_rect()
         x += self.module.x
@@ -173,8 +461,10 @@ class VisualEnumSetting(Setting):
                 self.choice = index
                 self.module.setting_changed()
     def get_rect(self):
-        return (max([_input.get_rect()[2] for _input in self.module.inputs.values()] + [0]),
-                30 + (self.index*20), self.module.synth.smallfont.size(str(self.value))[0] + 20, 20)
+        return self._rect
+    def compute_rect(self):
+        return (self.module._input_col_width,
+                30 + (self.index*20), cached_size(self.module.synth.smallfont, str(self.value))[0] + 20, 20)
 
 class VisualTextSetting(Setting):
     def __init__(self, module, name, default):
@@ -187,11 +477,16 @@ class VisualTextSetting(Setting):
     def draw(self, surface):
         x,y,w,h = self.get_rect()
         pygame.draw.rect(surface, (70,70,70), pygame.Rect(x, y+2, w, h-4))
-        value_text = self.module.synth.smallfont.render(str(self.value), True, (250,250,250))
+        value_text = cached_render(self.module.synth.smallfont, str(self.value), (250,250,250))
         surface.blit(value_text, (x+5,y+4))
         if self.is_selected:
-            cursor_x = self.module.synth.smallfont.size(self.value[:self.cursor])[0]
+            cursor_x = cached_size(self.module.synth.smallfont, self.value[:self.cursor])[0]
             pygame.draw.line(surface, (250,250,250), (cursor_x + x + 5, y + 3), (cursor_x + x + 5, y + h - 3))
+    def on_click(self, synth):
+        if synth.text_selection is not None:
+            synth.text_selection.deselected()
+        synth.text_selection = self
+        self.selected()
     def keypress(self, keyevent):
         if keyevent.key == pygame.K_LEFT:
             if self.cursor > 0:
@@ -212,11 +507,15 @@ class VisualTextSetting(Setting):
     def selected(self):
         self.is_selected = True
         self.cursor = len(self.value)
+        self.module._dirty = True # the cursor is part of the module's cached surface
     def deselected(self):
         self.is_selected = False
+        self.module._dirty = True
     def get_rect(self):
-        return (max([_input.get_rect()[2] for _input in self.module.inputs.values()] + [0]),
-                30 + (self.index*20), self.module.synth.smallfont.size(str(self.value))[0] + 20, 20)
+        return self._rect
+    def compute_rect(self):
+        return (self.module._input_col_width,
+                30 + (self.index*20), cached_size(self.module.synth.smallfont, str(self.value))[0] + 20, 20)
 
 class VisualTriggerSetting:
     def __init__(self, module, name, action):
@@ -226,14 +525,19 @@ class VisualTriggerSetting:
         self.index = self.module.make_index('setting')
     def click(self):
         self.action(self.module)
+    def on_click(self, synth):
+        if not synth.connecting:
+            self.click()
     def draw(self, surface):
         x,y,w,h = self.get_rect()
         pygame.draw.rect(surface, (70,70,70), pygame.Rect(x, y+2, w, h-4))
-        value_text = self.module.synth.smallfont.render(str(self.name), True, (250,250,250))
+        value_text = cached_render(self.module.synth.smallfont, str(self.name), (250,250,250))
         surface.blit(value_text, (x+5,y+4))
     def get_rect(self):
-        return (max([_input.get_rect()[2] for _input in self.module.inputs.values()] + [0]),
-                30 + (self.index*20), self.module.synth.smallfont.size(str(self.name))[0] + 20, 20)
+        return self._rect
+    def compute_rect(self):
+        return (self.module._input_col_width,
+                30 + (self.index*20), cached_size(self.module.synth.smallfont, str(self.name))[0] + 20, 20)
 
 class Visualiser:
     def __init__(self, module, name, aspect_ratio, f):
@@ -242,21 +546,31 @@ class Visualiser:
         self.name = name
         self.aspect_ratio = aspect_ratio
         self.f = f
-    def draw(self, surface):
+        self._surface = None # scratch surface handed to f, reused between frames
+    def render(self):
+        # returns the visualiser's surface - unlike the rest of the module it changes every frame,
+        # so the synth blits it over the module's cached surface separately
         x,y,w,h = self.get_rect()
+        if self._surface is None or self._surface.get_size() != (int(w), int(h)):
+            self._surface = pygame.Surface((w,h))
+            if pygame.display.get_surface() is not None:
+                self._surface = self._surface.convert()
         overall_inputs = {k:self.module.inputs[k].connection.value
                           if (self.module.inputs[k].connection is not None and
                               self.module.inputs[k].connection.value is not None)
                           else self.module.inputs[k].default for k in self.module.inputs}
-        surface.blit(self.f(pygame.Surface((w,h)), overall_inputs, self.module.current_values, self.module),
-                     (x,y))
+        return self.f(self._surface, overall_inputs, self.module.current_values, self.module)
     def get_rect(self):
+        return self._rect
+    def compute_rect(self):
         return (0,
                 self.module.titleheight +
                 max(sum([_input.get_rect()[3] for _input in self.module.inputs.values()]),
                     sum([output.get_rect()[3] for output in self.module.outputs.values()])),
                 self.module.w, (self.module.w/self.aspect_ratio[0])*self.aspect_ratio[1])
 
+_setting_widget_types = {"enum": VisualEnumSetting, "trig": VisualTriggerSetting, "text": VisualTextSetting}
+
 class VisualModule(Module):
     x = 0
     y = 0
@@ -264,20 +578,55 @@ class VisualModule(Module):
     h = 0
     titleheight = 30
     visualiser = None # (name, aspect_ratio, f)
+    _widget_ctors = {}
+    def __init_subclass__(cls, **kwargs):
+        # resolve each setting's kind string to its widget class once per module class, so
+        # spawning modules from the menu doesn't re-dispatch on strings per instance
+        super().__init_subclass__(**kwargs)
+        if "settings" in cls.__dict__:
+            cls._widget_ctors = {name: _setting_widget_types[config[0]] for name, config in cls.settings.items()
+                                 if config[0] in _setting_widget_types}
     def gen_widgets(self):
         self.indices = {}
-        self.inputs = {name: VisualInput(self, name, _type, default) for name,(_type,default) in self.inputs.items()}
-        self.outputs = {name: VisualOutput(self, name, _type) for name,_type in self.outputs.items()}
-        new_settings = {}
-        for name,config in self.settings.items():
-           if config[0] == "enum":
-               new_settings[name] = VisualEnumSetting(self, name, config[1], config[2])
-           elif config[0] == "trig":
-               new_settings[name] = VisualTriggerSetting(self, name, config[1])
-           elif config[0] == "text":
-               new_settings[name] = VisualTextSetting(self, name, config[1])
-        self.settings = new_settings
+        self._dirty = True
+        self._cached_surface = None
+        self._drawn_error = None
+        self._title_size = None
+        self.inputs = {name: VisualInput(self, name, _type, default) for name, _type, default in self._input_spec}
+        self.outputs = {name: VisualOutput(self, name, _type) for name, _type in self._output_spec}
+        self.settings = {name: self._widget_ctors[name](self, name, *config[1:])
+                         for name, config in self._setting_spec if name in self._widget_ctors}
         self.visualiser = Visualiser(self, self.visualiser[0], self.visualiser[1], self.visualiser[2]) if self.visualiser is not None else None
+        self._regen_live_inputs()
+        self.recompute_layout()
+    def recompute_layout(self):
+        # widget rects (and the module's overall size) only change when a setting's text does,
+        # so they're computed here once and cached rather than rederived through font.size every frame.
+        # order matters: settings' x depends on input widths, outputs' x and the visualiser depend on module width
+        for _input in self.inputs.values():
+            _input._rect = _input.compute_rect()
+        # every setting sits in the column right of the inputs, so the column offset is computed
+        # once here instead of each setting re-maxing over the inputs
+        self._input_col_width = max([_input._rect[2] for _input in self.inputs.values()] + [0])
+        for setting in self.settings.values():
+            setting._rect = setting.compute_rect()
+        if self._title_size is None: # the name never changes, so measure it once
+            self._title_size = self.synth.font.size(self.name)
+        titlewidth = self._title_size[0] + 10 + 20
+        self.w = max(titlewidth, self._input_col_width +
+                                 max([setting._rect[2] for setting in self.settings.values()] + [0]) +
+                                 (20 if self.outputs else 0))
+        for output in self.outputs.values():
+            output._rect = output.compute_rect()
+        if self.visualiser is not None:
+            self.visualiser._rect = self.visualiser.compute_rect()
+        self.h = (self.titleheight +
+                  max(sum([_input._rect[3] for _input in self.inputs.values()]),
+                      sum([setting._rect[3] for setting in self.settings.values()]),
+                      sum([output._rect[3] for output in self.outputs.values()])) +
+                  (self.visualiser._rect[3] if self.visualiser is not None else 0))
+        # flat widget list for hit testing, so mouse handling doesn't rebuild it per event
+        self._widgets = list(self.inputs.values()) + list(self.settings.values()) + list(self.outputs.values())
     def make_index(self, kind):
         if kind in self.indices:
             self.indices[kind] += 1
@@ -291,46 +640,58 @@ class VisualModule(Module):
                 return "module closed"
             return "drag bar"
         else:
-            for widget in list(self.inputs.values()) + list(self.settings.values()) + list(self.outputs.values()):
+            for widget in self._widgets:
                 x,y,w,h = widget.get_rect()
                 if (pos[0] > self.x + x and pos[0] < self.x + x + w and
                     pos[1] > self.y + y and pos[1] < self.y +y + h):
                     return widget
-    def draw(self, screen):
-        titlewidth = self.synth.font.size(self.name)[0] + 10 + 20
-        titleheight = 30
-        height = (titleheight +
-                  max(sum([_input.get_rect()[3] for _input in self.inputs.values()]),
-                      sum([setting.get_rect()[3] for setting in self.settings.values()]),
-                      sum([output.get_rect()[3] for output in self.outputs.values()])) +
-                  (self.visualiser.get_rect()[3] if self.visualiser is not None else 0))
-        width = max(titlewidth, max([_input.get_rect()[2] for _input in self.inputs.values()] + [0]) +
-                                max([setting.get_rect()[2] for setting in self.settings.values()] + [0]) +
-                                max([output.get_rect()[2] for output in self.outputs.values()] + [0]))
-        self.h = height
-        self.w = width
-        surface = pygame.Surface((width, height))
+    def setting_changed(self):
+        super().setting_changed()
+        self.recompute_layout() # setting value text may have changed width
+        self._dirty = True
+    def draw(self):
+        # returns the module's surface, rebuilding it only when something visible has changed -
+        # the synth batches all the module blits together and overlays the visualiser separately
+        if self.error is not self._drawn_error:
+            self._dirty = True
+        if self._dirty:
+            self._cached_surface = self._rebuild_surface()
+            self._drawn_error = self.error
+            self._dirty = False
+        return self._cached_surface
+    def _rebuild_surface(self):
+        width, height = self.w, self.h # computed by recompute_layout
+        titleheight = self.titleheight
+        # redraw over the previous surface when the module hasn't changed size, rather than
+        # allocating a fresh one per rebuild
+        if self._cached_surface is not None and self._cached_surface.get_size() == (int(width), int(height)):
+            surface = self._cached_surface
+        else:
+            surface = pygame.Surface((width, height))
+            if pygame.display.get_surface() is not None:
+                surface = surface.convert() # display pixel format, so the per-frame blit is a straight copy
         surface.fill((100,100,100))
+        # hold one lock across the burst of primitive draws, so each one doesn't lock/unlock the
+        # surface on its own. the text blits happen after the unlock - blitting to a locked surface is an error
+        surface.lock()
         if self.error is None:
             pygame.draw.rect(surface, (50,50,50), pygame.Rect(0, 0, width, titleheight))
-            title = self.synth.font.render(self.name, True, (250,250,250))
+            title = cached_render(self.synth.font, self.name, (250,250,250))
         else:
             pygame.draw.rect(surface, (100, 50, 50), pygame.Rect(0,0,width,titleheight))
-            title = self.synth.smallfont.render(str(self.error), True, (250,250,250))
-        surface.blit(title, (5, 5))
+            title = cached_render(self.synth.smallfont, str(self.error), (250,250,250))
         pygame.draw.line(surface, (250, 250, 250), (width - 18, 2), (width - 2, 18))
         pygame.draw.line(surface, (250, 250, 250), (width - 2, 2), (width - 18, 18))
         for _input in self.inputs.values():
             _input.draw(surface)
         for output in self.outputs.values():
             output.draw(surface)
+        surface.unlock()
+        surface.blit(title, (5, 5))
         for setting in self.settings.values():
-            setting.draw(surface)
-        if self.visualiser is not None:
-            self.visualiser.draw(surface)
-        screen.blit(surface, (self.x, self.y))
-            
-        
+            setting.draw(surface) # settings blit their value text, so they stay outside the lock
+        return surface
+
 
 class RightClickMenu:
     location = (0,0)
@@ -339,13 +700,15 @@ class RightClickMenu:
         self.library = library
         self.width = max([synth.smallfont.size(module.name)[0] for module in library]) + 10
         self.height = 20 * len(library)
-    def draw_menu(self, surface):
-        x,y = self.location
-        pygame.draw.rect(surface, (70, 70, 70), pygame.Rect(x, y, self.width, self.height + 10))
+        # the library is fixed for the synth's lifetime, so the whole menu renders once here
+        self._menu_surface = pygame.Surface((self.width, self.height + 10))
+        self._menu_surface.fill((70, 70, 70))
         for i in range(len(self.library)):
-            pygame.draw.rect(surface, (100,100,100), pygame.Rect(x+5, (20*i) + y + 5, self.width - 10, 18))
-            value_text = self.synth.smallfont.render(self.library[i].name, True, (250,250,250))
-            surface.blit(value_text, (x + 5, (20*i) + y + 8))
+            pygame.draw.rect(self._menu_surface, (100,100,100), pygame.Rect(5, (20*i) + 5, self.width - 10, 18))
+            value_text = cached_render(self.synth.smallfont, self.library[i].name, (250,250,250))
+            self._menu_surface.blit(value_text, (5, (20*i) + 8))
+    def draw_menu(self, surface):
+        surface.blit(self._menu_surface, self.location)
     def menu_click(self, pos):
         if pos[0] > self.location[0] and pos[0] < self.location[0] + self.width:
             index = int((pos[1] - (self.location[1] + 5))/20)
@@ -355,6 +718,7 @@ class RightClickMenu:
 class VisualSynth(Synth):
     def __init__(self, library, rate = 10):
         super().__init__(rate = rate)
+        _ensure_pygame()
         self.font = pygame.font.Font(None, 24)
         self.smallfont = pygame.font.Font(None, 18)
         self.dragging = None
@@ -363,25 +727,63 @@ class VisualSynth(Synth):
         self.text_selection = None
         self.tooltip_open = None
         self.right_click_menu = RightClickMenu(self, library)
+        self._wires_surf = None # all the cables pre-drawn, redrawn only when connections or positions change
+        self._wires_dirty = True
+    def graph_changed(self):
+        super().graph_changed()
+        self._wires_dirty = True
     def create_module(self, module, location = (0,0)):
         module = super().create_module(module)
         module.x = location[0]
         module.y = location[1]        
-    def render(self, size):
-        surface = pygame.Surface(size)
+    def render(self, surface):
+        # draws straight onto the given surface (the display in practice) - going via an
+        # intermediate screen-sized surface cost an extra full-screen copy per frame
+        size = surface.get_size()
         surface.fill("purple")
+        # one batched blits call instead of a python-level blit per module
+        # (fblits is the faster variant but only exists in pygame-ce)
+        blit_pairs = []
+        screen_rect = pygame.Rect((0,0), size)
         for module in self.modules:
-            module.draw(surface)
-        for module in self.modules:
-            for _input in module.inputs.values():
-                if _input.connection:
-                    xa,ya,wa,ha = _input.get_rect()
-                    xb,yb,wb,hb = _input.connection.get_rect()
-                    xa += _input.module.x
-                    ya += _input.module.y
-                    xb += _input.connection.module.x
-                    yb += _input.connection.module.y
-                    pygame.draw.line(surface, (200,200,200), (xa + (wa/2), ya + (ha/2)), (xb + (wb/2), yb + (hb/2)), width = 3)
+            # modules dragged offscreen don't need their surfaces rebuilt or blitted at all
+            if not screen_rect.colliderect(pygame.Rect(module.x, module.y, module.w, module.h)):
+                continue
+            blit_pairs.append((module.draw(), (module.x, module.y)))
+            if module.visualiser is not None:
+                x,y,w,h = module.visualiser.get_rect()
+                blit_pairs.append((module.visualiser.render(), (module.x + x, module.y + y)))
+        if hasattr(surface, 'fblits'):
+            surface.fblits(blit_pairs)
+        else:
+            surface.blits(blit_pairs, doreturn = False)
+        # the cables live on their own transparent surface, redrawn only when a connection is
+        # made/broken or a module moves - most frames it's just one blit
+        if self._wires_surf is None or self._wires_surf.get_size() != size:
+            self._wires_surf = pygame.Surface(size, pygame.SRCALPHA)
+            if pygame.display.get_surface() is not None:
+                self._wires_surf = self._wires_surf.convert_alpha()
+            self._wires_dirty = True
+        if self._wires_dirty:
+            self._wires_surf.fill((0,0,0,0))
+            # gather all the cable geometry first, do the midpoint arithmetic in one numpy pass,
+            # then just issue the draw calls (cables are disjoint segments, so they can't be a
+            # single polyline - but the per-endpoint python arithmetic batches fine)
+            cables = []
+            for module in self.modules:
+                for _input in module.inputs.values():
+                    if _input.connection:
+                        xa,ya,wa,ha = _input.get_rect()
+                        xb,yb,wb,hb = _input.connection.get_rect()
+                        cables.append((module.x + xa + wa/2, module.y + ya + ha/2,
+                                       _input.connection.module.x + xb + wb/2,
+                                       _input.connection.module.y + yb + hb/2))
+            if cables:
+                endpoints = np.array(cables).reshape(-1, 2, 2)
+                for (a, b) in endpoints:
+                    pygame.draw.line(self._wires_surf, (200,200,200), a, b, width = 3)
+            self._wires_dirty = False
+        surface.blit(self._wires_surf, (0,0))
         if self.connecting:
             x,y,w,h = self.connecting.get_rect()
             x += self.connecting.module.x
@@ -392,18 +794,18 @@ class VisualSynth(Synth):
             x,y,w,h = self.tooltip_open.get_rect()
             x += self.tooltip_open.module.x + (w/2)
             y += self.tooltip_open.module.y + (h/2)
-            w,h = self.smallfont.size(self.tooltip_open.name)
+            w,h = cached_size(self.smallfont, self.tooltip_open.name)
             pygame.draw.rect(surface, (170,170,170), pygame.Rect(x,y,w+10, h+10))
-            text = self.smallfont.render(self.tooltip_open.name, True, (0,0,0))
+            text = cached_render(self.smallfont, self.tooltip_open.name, (0,0,0))
             surface.blit(text, (x + 5, y + 5))
         if self.menu_open is not None:
             self.menu_open.draw_menu(surface)
-        return surface
     def mouse(self, mouseevent):
         if self.dragging:
             if mouseevent.type == pygame.MOUSEMOTION:
                 self.dragging.x += mouseevent.rel[0]
                 self.dragging.y += mouseevent.rel[1]
+                self._wires_dirty = True # cable endpoints follow the module
             elif mouseevent.type == pygame.MOUSEBUTTONUP:
                 self.dragging = None
         elif self.menu_open:
@@ -428,45 +830,18 @@ class VisualSynth(Synth):
 
                 if module_found is not None:
                     clicked_on = module.mouse_click(mouseevent.pos)
+                    # each widget class knows what clicking it means, so dispatch polymorphically
+                    # instead of walking an isinstance chain here
                     if clicked_on == 'drag bar':
                         self.dragging = module
-                    elif isinstance(clicked_on, VisualInput):
-                        if self.connecting:
-                            if isinstance(self.connecting, VisualOutput):
-                                if clicked_on.connection == self.connecting:
-                                    clicked_on.module.disconnect(clicked_on.name)
-                                else:
-                                    clicked_on.module.connect_from(clicked_on.name, self.connecting.module, self.connecting.name)
-                            self.connecting = None
-                        else:
-                            self.connecting = clicked_on
-                    elif isinstance(clicked_on, VisualOutput):
-                        if self.connecting:
-                            if isinstance(self.connecting, VisualInput):
-                                if self.connecting.connection == clicked_on:
-                                    self.connecting.module.disconnect(self.connecting.name)
-                                else:
-                                    self.connecting.module.connect_from(self.connecting.name, clicked_on.module, clicked_on.name)
-                            self.connecting = None
-                        else:
-                            self.connecting = clicked_on
-                    elif isinstance(clicked_on, VisualEnumSetting):
-                        if not self.connecting:
-                            self.menu_open = clicked_on
-                    elif isinstance(clicked_on, VisualTriggerSetting):
-                        if not self.connecting:
-                            clicked_on.click()
-                    elif isinstance(clicked_on, VisualTextSetting):
-                        if self.text_selection is not None:
-                            self.text_selection.deselected()
-                        self.text_selection = clicked_on
-                        self.text_selection.selected()
+                    elif clicked_on is not None and not isinstance(clicked_on, str):
+                        clicked_on.on_click(self)
                 else:
                     self.connecting = None
             elif mouseevent.type == pygame.MOUSEMOTION:
                 if module_found:
                     self.tooltip_open = None
-                    for widget in list(module_found.inputs.values()) + list(module_found.settings.values()) + list(module_found.outputs.values()):
+                    for widget in module_found._widgets:
                         x,y,w,h = widget.get_rect()
                         if (mouseevent.pos[0] > module.x + x and mouseevent.pos[0] < module.x + x + w and
                             mouseevent.pos[1] > module.y + y and mouseevent.pos[1] < module.y + y + h):
@@ -483,10 +858,12 @@ def window(synth, framerate):
     clock = pygame.time.Clock()
     running = True
     t = 0
-    repeat_counter = RepeatCounter(synth.rate)
+    # the block size only depends on the synth rate and framerate, so compute it once here.
+    # rounding errors are possible, which may matter for audio
+    block = math.ceil(synth.rate / framerate)
     while running:
-        # do the right amount of iterations to have the specified synth sample rate. rounding errors are possible, which may matter for audio
-        synth.run(repeat_counter.repeats(t), t, 1/framerate)
+        # do one block of samples per visual frame, sized to achieve the specified synth sample rate
+        synth.run(block, t, 1/framerate)
         t += 1/framerate
 
         # poll for events
@@ -498,7 +875,7 @@ def window(synth, framerate):
             if event.type == pygame.KEYDOWN:
                 synth.key(event)
 
-        screen.blit(synth.render(screen.get_size()), (0,0))
+        synth.render(screen)
 
         # flip() the display to put your work on screen
         pygame.display.flip()
@@ -510,32 +887,84 @@ def window(synth, framerate):
 ## TESTING
 
 # test modules
+
+# scalar waveform kernels for Osc, compiled to machine code when numba is available.
+# these used to be lambdas rebuilt in a dict literal on every single sample
+@njit(cache=True, fastmath=True, nogil=True)
+def _osc_sin(x):
+    return math.sin(2 * math.pi * x)
+@njit(cache=True, fastmath=True, nogil=True)
+def _osc_tri(x):
+    return abs(((4*x) % 4) - 2) - 1
+@njit(cache=True, fastmath=True, nogil=True)
+def _osc_saw(x):
+    return (abs(2*x) % 2) - 1
+@njit(cache=True, fastmath=True, nogil=True)
+def _osc_squ(x):
+    return 1. if (x % 1) < 0.5 else -1.
+_OSC_WAVEFORMS = (_osc_sin, _osc_tri, _osc_saw, _osc_squ)
+for _kernel in _OSC_WAVEFORMS:
+    _kernel(0.) # warm up the jit compiles at import (cache=True reloads from disk after the first run)
+
+def _osc_sin_block(x):
+    return np.sin(2 * np.pi * x)
+def _osc_tri_block(x):
+    return np.abs(((4*x) % 4) - 2) - 1
+def _osc_saw_block(x):
+    return (np.abs(2*x) % 2) - 1
+def _osc_squ_block(x):
+    return np.where((x % 1) < 0.5, 1., -1.)
+_OSC_WAVEFORMS_BLOCK = (_osc_sin_block, _osc_tri_block, _osc_saw_block, _osc_squ_block)
+
 class Osc(VisualModule):
     name = "Osc"
     inputs = {"frequency": (float, 1.), "phase": (float, 0.)}
     outputs = {"out": float}
     settings = {"waveform": ("enum", ["sin", "tri", "saw", "squ"], 0)}
+    def __init__(self, synth):
+        super().__init__(synth)
+        self.setting_changed()
+    def setting_changed(self):
+        super().setting_changed()
+        # bind the selected kernels directly so f/f_block don't re-select per call -
+        # the enum choice index doubles as an index into the kernel tables
+        choice = self.settings["waveform"].choice
+        self._compute = _OSC_WAVEFORMS[choice]
+        self._compute_block = _OSC_WAVEFORMS_BLOCK[choice]
     def f(self, t, frequency, phase):
-        return {"out": {"sin": lambda x: math.sin(2 * math.pi * x),
-                        "tri": lambda x: abs(((4*x)%4)-2)-1,
-                        "saw": lambda x: (abs(2*x)%2)-1,
-                        "squ": lambda x: 1 if (x%1) < 0.5 else -1}[self.settings["waveform"].value]((t + phase)*frequency)}
+        return {"out": self._compute((t + phase)*frequency)}
+    def f_block(self, t, frequency, phase):
+        return {"out": self._compute_block((t + phase)*frequency)}
 
 def lightvis_f(surface, inputs, outputs, module):
-    surface.fill((127+int(inputs['value']*127),0,0))
+    # only refill when the displayed colour actually changes - slowly-moving signals mostly
+    # don't. the surface identity check catches the visualiser handing us a fresh surface
+    # after a resize, which needs filling regardless
+    c = 127+int(inputs['value']*127)
+    if c != module._last_colour or surface is not module._last_surface:
+        surface.fill((c,0,0))
+        module._last_colour = c
+        module._last_surface = surface
     return surface
 class LightVis(VisualModule):
     name = "Light Visualiser"
     inputs = {"value": (float, 0.)}
     visualiser = ("lightvis", (2,1), lightvis_f)
+    _last_colour = None
+    _last_surface = None
     def f(self, t, value):
         return {}
 
 def videoout_f(surface, inputs, outputs, module):
+    # one blit_array flush of the whole frame's writes, instead of touching the surface per
+    # block - and only when something was actually written since the last flush
+    if module._flush_dirty:
+        pygame.surfarray.blit_array(module.screenbuffer, module._buf)
+        module._flush_dirty = False
     return module.screenbuffer
 def resetscreenbuffer(module):
-    _,_,w,h = module.visualiser.get_rect()
-    module.screenbuffer = pygame.Surface((w,h))
+    module._buf[:] = 0
+    module._flush_dirty = True
 class VideoOut(VisualModule):
     name = "--------------- Video Output ---------------"
     inputs = {"x": (float, 0.), "y": (float, 0.), "r": (float, 0.), "g": (float, 0.), "b": (float, 0.)}
@@ -545,15 +974,48 @@ class VideoOut(VisualModule):
     def __init__(self, synth):
         super().__init__(synth)
         _,_,w,h = self.visualiser.get_rect()
-        self.screenbuffer = pygame.Surface((w,h))
-    def f(self, t, x, y, r, g, b):
-        pixelsize = self.settings["pixel size"].value
+        self.screenbuffer = self._make_screenbuffer((w,h))
+        self._buf_w, self._buf_h = self.screenbuffer.get_size()
+        self._buf = np.zeros((self._buf_w, self._buf_h, 3), dtype = np.uint8)
+        self._flush_dirty = True
+        self.setting_changed()
+    def _make_screenbuffer(self, size):
+        surface = pygame.Surface(size)
+        if pygame.display.get_surface() is not None:
+            surface = surface.convert() # blitted to the display every frame, so match its format
+        return surface
+    def setting_changed(self):
+        super().setting_changed()
+        # resolved once here rather than through settings dict + enum property per sample
+        self._pixelsize = self.settings["pixel size"].value
+    def on_frame_start(self, block_len):
+        # check the visualiser rect against the buffer once per frame instead of every block/sample
         _,_,w,h = self.visualiser.get_rect()
-        buffer_w, buffer_h = self.screenbuffer.get_size()
-        if buffer_w != w or buffer_h != h:
-            self.screenbuffer = pygame.Surface((w,h))
-        pygame.draw.rect(self.screenbuffer, ((127+int(r*127))%256,(127+int(g*127))%256,(127+int(b*127))%256),
-                         (int((x+1)*buffer_w*0.5*(1/pixelsize))*pixelsize, int((y+1)*buffer_h*0.5*(1/pixelsize))*pixelsize, pixelsize, pixelsize))
+        if self.screenbuffer.get_size() != (int(w), int(h)):
+            self.screenbuffer = self._make_screenbuffer((w,h))
+            self._buf_w, self._buf_h = self.screenbuffer.get_size()
+            self._buf = np.zeros((self._buf_w, self._buf_h, 3), dtype = np.uint8)
+            self._flush_dirty = True
+    def f(self, t, x, y, r, g, b):
+        return self.f_block(np.zeros(1), x, y, r, g, b)
+    def f_block(self, t, x, y, r, g, b):
+        # write the whole block's pixels as a few vectorised numpy stores, instead of one
+        # pygame.draw.rect (a full SDL call) per sample
+        pixelsize = self._pixelsize
+        buffer_w, buffer_h = self._buf_w, self._buf_h
+        n = len(t)
+        x, y, r, g, b = (np.broadcast_to(np.asarray(v, dtype = np.float64), (n,)) for v in (x, y, r, g, b))
+        xs = ((x+1)*buffer_w*0.5*(1/pixelsize)).astype(np.int64)*pixelsize
+        ys = ((y+1)*buffer_h*0.5*(1/pixelsize)).astype(np.int64)*pixelsize
+        # one fused scale-clamp-cast over the whole block; out-of-range channels saturate
+        colours = np.stack([r*127+127, g*127+127, b*127+127], axis = 1).clip(0, 255).astype(np.uint8)
+        # write into the persistent array - the visualiser callback flushes it to the surface
+        # once per frame, so no surface lock is held while samples are being processed
+        pixels = self._buf
+        for dx in range(pixelsize):
+            for dy in range(pixelsize):
+                pixels[np.clip(xs+dx, 0, buffer_w-1), np.clip(ys+dy, 0, buffer_h-1)] = colours
+        self._flush_dirty = True
         return {}
 
 class PathGen(VisualModule):
@@ -565,121 +1027,228 @@ class PathGen(VisualModule):
                 "direction": ("enum", ["forwards", "reverse"], 0)}
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.repeat_counter = RepeatCounter(int(self.settings["speed"].value))
-        self.gen_path()
+        self.repeat_counter = RepeatCounter(1)
+        self.setting_changed()
     def f(self, t):
+        res = self._res
+        if self._speed is None:
+            raise Exception(f"speed must be a number, not '{self.settings['speed'].value}'")
+        speed = self._speed
+        n = self._path_len
+        index = min(math.floor(((t%(1/speed))/(1/speed))*n), n-1)
+        if self._direction != "forwards":
+            index = n - index
+        return {"x": (self._path_x[index]/(res/2))-1, "y": (self._path_y[index]/(res/2))-1}
+    def f_block(self, t):
+        # the whole block's indices into the path are closed-form in t, so compute them as one
+        # numpy expression and gather from the pre-tabulated coordinate arrays
+        res = self._res
+        if self._speed is None:
+            raise Exception(f"speed must be a number, not '{self.settings['speed'].value}'")
+        period = 1/self._speed
+        n = self._path_len
+        index = np.minimum(np.floor(((t % period)/period)*n).astype(np.int64), n-1)
+        if self._direction != "forwards":
+            index = n - index
+        return {"x": (self._path_x[index]/(res/2))-1, "y": (self._path_y[index]/(res/2))-1}
+    def setting_changed(self):
+        super().setting_changed()
+        # settings are parsed here once rather than per sample in f/gen_path
         try:
             res = int(self.settings["resolution"].value)
             1/res # to make sure res isn't 0
         except:
             res = 1
-        speed = float(self.settings["speed"].value)
-        index = min(math.floor(((t%(1/speed))/(1/speed))*len(self.path)), len(self.path)-1)
-        x,y = self.path[index if self.settings["direction"].value == "forwards" else (len(self.path)-index)]
-        return {"x": (x/(res/2))-1, "y": (y/(res/2))-1}
-    def setting_changed(self):
+        self._res = res
+        try:
+            self._speed = float(self.settings["speed"].value)
+        except:
+            self._speed = None
+        self._mode = self.settings["mode"].value
+        self._direction = self.settings["direction"].value
         try:
             self.repeat_counter.rate = int(self.settings["speed"].value)
         except:
             pass
         self.gen_path()
+    _path_cache = {} # (mode, res) -> tabulated path, shared across instances so mode flips are free
     def gen_path(self):
-        try:
-            res = int(self.settings["resolution"].value)
-            1/res # to make sure res isn't 0
-        except:
-            res = 1
-        mode = self.settings["mode"].value
-        self.path = []
+        # tabulates the path straight into coordinate arrays - at 300x300 that's 90k points, so
+        # building them as numpy expressions beats appending python tuples by a wide margin
+        res = self._res
+        mode = self._mode
+        cached = PathGen._path_cache.get((mode, res))
+        if cached is not None:
+            self._path_x, self._path_y = cached
+            self._path_len = len(self._path_x)
+            return
+        line = np.arange(res, dtype = np.float64)
         if mode == "vertical":
-            for y in range(0, res):
-                for x in range(0, res):
-                    self.path.append((x,y))
+            xs = np.tile(line, res)
+            ys = np.repeat(line, res)
         elif mode == "horizontal":
-            for x in range(0, res):
-                for y in range(0, res):
-                    self.path.append((x,y))
+            xs = np.repeat(line, res)
+            ys = np.tile(line, res)
         elif mode == "boustro (v)":
-            for y in range(0, res):
-                for x in range(0, res):
-                    if y % 2 == 0:
-                        self.path.append((x,y))
-                    else:
-                        self.path.append(((res-1)-x, y))
+            xs = np.tile(line, res).reshape(res, res)
+            xs[1::2] = xs[1::2, ::-1] # odd rows run backwards
+            xs = xs.ravel()
+            ys = np.repeat(line, res)
         elif mode == "boustro (h)":
-            for x in range(0, res):
-                for y in range(0, res):
-                    if x % 2 == 0:
-                        self.path.append((x,y))
-                    else:
-                        self.path.append((x, (res-1)-y))
+            xs = np.repeat(line, res)
+            ys = np.tile(line, res).reshape(res, res)
+            ys[1::2] = ys[1::2, ::-1]
+            ys = ys.ravel()
         elif mode == "spiral":
+            xs_parts = []
+            ys_parts = []
             for sidelen in range(res, 0, -2):
                 margin = (res-sidelen)/2
-                self.path += [(margin + x, margin) for x in range(0, sidelen)]
-                self.path += [(margin + sidelen, margin + y) for y in range(0, sidelen)]
-                self.path += [(margin + sidelen - x, margin + sidelen) for x in range(0, sidelen)]
-                self.path += [(margin, margin + sidelen - y) for y in range(0, sidelen)]
-            self.path.append((res/2,res/2))
+                edge = np.arange(sidelen, dtype = np.float64)
+                fixed = np.full(sidelen, margin)
+                xs_parts += [margin + edge, fixed + sidelen, margin + sidelen - edge, fixed]
+                ys_parts += [fixed, margin + edge, fixed + sidelen, margin + sidelen - edge]
+            xs_parts.append(np.array([res/2]))
+            ys_parts.append(np.array([res/2]))
+            xs = np.concatenate(xs_parts)
+            ys = np.concatenate(ys_parts)
+        else:
+            xs = np.zeros(1)
+            ys = np.zeros(1)
+        self._path_x = xs
+        self._path_y = ys
+        self._path_len = len(xs)
+        if len(PathGen._path_cache) > 32: # crude bound - tabulated paths can be res*res points
+            PathGen._path_cache.clear()
+        PathGen._path_cache[(mode, res)] = (xs, ys)
 
 class Constant(VisualModule):
     name = "Constant"
+    depends_on_t = False
     outputs = {"value": float}
     settings = {"value": ("text", "0")}
-    def f(self, t):
+    def __init__(self, synth):
+        super().__init__(synth)
+        self.setting_changed()
+    def setting_changed(self):
+        super().setting_changed()
+        # parsed once per edit instead of float()-ing the text per sample
         try:
-            return {"value": float(self.settings["value"].value)}
+            self._value = float(self.settings["value"].value)
         except:
-            return {"value": 0.}
+            self._value = 0.
+    def f(self, t):
+        return {"value": self._value}
 
 class Add(VisualModule):
     name = "Add"
+    depends_on_t = False
     inputs = {"a": (float, 0.), "b": (float, 0.)}
     outputs = {"sum": float}
     def f(self, t, a, b):
         return {"sum": a + b}
+    def f_block(self, t, a, b):
+        # broadcast so the output is always a full-length block even when both inputs are scalars
+        return {"sum": np.broadcast_to(np.asarray(a + b, dtype = np.float64), t.shape)}
 
 class Multiply(VisualModule):
     name = "Multiply"
+    depends_on_t = False
     inputs = {"a": (float, 1.), "b": (float, 1.)}
     outputs = {"product": float}
     def f(self, t, a, b):
         return {"product": a * b}
+    def f_block(self, t, a, b):
+        return {"product": np.broadcast_to(np.asarray(a * b, dtype = np.float64), t.shape)}
 
 class EvalExpr(VisualModule):
     name = "Expression"
+    depends_on_t = False
     inputs = {"x": (float, 0.), "y": (float, 0.), "z": (float, 0.)}
     outputs = {"value": float}
     settings = {"expression": ("text", "x + y + z")}
     compiled_expression = compile("x + y + z", "<user-defined expression>", "eval")
+    def __init__(self, synth):
+        super().__init__(synth)
+        # one reused globals dict mutated in place, plus a bounded memo over (expression version,
+        # inputs) - signals driven by thresholds/constants repeat values constantly, so most
+        # evals are redundant
+        self._globals = {"x": 0., "y": 0., "z": 0., "math": math}
+        self._cached_eval = functools.lru_cache(maxsize = 1024)(self._raw_eval)
+        self.setting_changed()
+    def _raw_eval(self, version, x, y, z):
+        if self._fn is not None:
+            return self._fn(x, y, z)
+        self._globals["x"] = x
+        self._globals["y"] = y
+        self._globals["z"] = z
+        return eval(self.compiled_expression, self._globals)
     def f(self, t, x, y, z):
         try:
-            return {"value": eval(self.compiled_expression, {"x": x, "y": y, "z": z, "math": math})}
+            return {"value": self._cached_eval(self._settings_version, x, y, z)}
         except:
             return {"value": 0.}
+    _fn = None
     def setting_changed(self):
+        super().setting_changed()
         try:
             self.compiled_expression = compile(self.settings["expression"].value, "<user-defined expression>", "eval")
         except:
             pass
+        # wrap the expression in a real function where possible - a direct call skips eval's
+        # per-invocation frame and globals machinery. eval stays as the fallback
+        try:
+            namespace = {"math": math}
+            exec("def _f(x, y, z, math = math):\n    return (" + self.settings["expression"].value + ")", namespace)
+            self._fn = namespace["_f"]
+        except:
+            self._fn = None
         
 
 class Threshold(VisualModule):
     name = "Threshold"
+    depends_on_t = False
     inputs = {"value": (float, 0.), "threshold": (float, 0.)}
     outputs = {"gate": bool}
     def f(self, t, value, threshold):
         return {"gate": value > threshold}
+    def f_block(self, t, value, threshold):
+        return {"gate": np.broadcast_to(np.asarray(value) > np.asarray(threshold), t.shape)}
 
 class Choice(VisualModule):
     name = "Choice"
+    depends_on_t = False
     inputs = {"gate": (bool, True), "a": (float, 0.), "b": (float, 0.)}
     outputs = {"out": float}
     def f(self, t, gate, a, b):
         return {"out": a if gate else b}
+    def f_block(self, t, gate, a, b):
+        # gates are control-rate and usually hold still for a whole block - in that case just
+        # hand back the chosen side as a view, no per-sample select needed
+        if isinstance(gate, np.ndarray):
+            if gate.all():
+                gate = True
+            elif not gate.any():
+                gate = False
+            else:
+                return {"out": np.broadcast_to(np.where(gate, a, b), t.shape)}
+        return {"out": np.broadcast_to(np.asarray(a if gate else b), t.shape)}
 
 def adsr_trigger(module):
     module.manually_triggered = True
+@njit(cache = True, fastmath = True, nogil = True)
+def _adsr_eval(progress, a, d, s, r):
+    # the scalar piecewise envelope, jitted for the step path (the block path is numpy)
+    if progress < a:
+        return progress/a
+    elif progress < a+d:
+        return 1 - (0.5*((progress - a)/d))
+    elif progress < a+d+s:
+        return 0.5
+    elif progress < a+d+s+r:
+        return 0.5 - (0.5*((progress - (a+d+s))/r))
+    return 0.
+_adsr_eval(0., 1., 1., 1., 1.) # warm up alongside the oscillator kernels
 class ADSR(VisualModule):
     name = "ADSR"
     inputs = {"gate": (bool, False)}
@@ -689,32 +1258,72 @@ class ADSR(VisualModule):
     prev_gate = False
     trigger_time = 0
     manually_triggered = False
+    def __init__(self, synth):
+        super().__init__(synth)
+        self.setting_changed()
+    def setting_changed(self):
+        super().setting_changed()
+        # the four stage lengths are parsed from their text settings once per edit, not per sample
+        try:
+            self._a, self._d, self._s, self._r = (float(self.settings["attack"].value), float(self.settings["decay"].value),
+                                                  float(self.settings["sustain"].value), float(self.settings["release"].value))
+            a,d,s,r = self._a, self._d, self._s, self._r
+            # cumulative stage boundaries, so the block path can find each sample's stage in
+            # one searchsorted instead of four chained comparisons
+            self._bounds = np.array([a, a+d, a+d+s, a+d+s+r])
+            self._valid = True
+        except:
+            self._valid = False
     def f(self, t, gate):
         if (gate == True and self.prev_gate == False) or self.manually_triggered:
             self.trigger_time = t
             self.manually_triggered = False
         self.prev_gate = gate
-        try:
-            a,d,s,r = (float(self.settings["attack"].value), float(self.settings["decay"].value),
-                       float(self.settings["sustain"].value), float(self.settings["release"].value))
-        except:
+        if not self._valid:
             return {"envelope": 0}
-        progress = t - self.trigger_time
-        if progress < a:
-            v = progress/a
-        elif progress < a+d:
-            v = 1 - (0.5*((progress - a)/d))
-        elif progress < a+d+s:
-            v = 0.5
-        elif progress < a+d+s+r:
-            v = 0.5 - (0.5*((progress - (a+d+s))/r))
-        else:
-            v = 0
+        return {"envelope": _adsr_eval(t - self.trigger_time, self._a, self._d, self._s, self._r)}
+    def f_block(self, t, gate):
+        gate = np.broadcast_to(np.asarray(gate, dtype = bool), t.shape)
+        # each sample's trigger time is the most recent rising edge at or before it, which is a
+        # running maximum over the edge times - so the whole block stays vectorised
+        prev = np.empty_like(gate)
+        prev[0] = self.prev_gate
+        prev[1:] = gate[:-1]
+        edges = gate & ~prev
+        if self.manually_triggered:
+            edges = edges.copy()
+            edges[0] = True
+            self.manually_triggered = False
+        trigger_times = np.where(edges, t, -np.inf)
+        if not edges[0]:
+            trigger_times[0] = self.trigger_time
+        trigger_times = np.maximum.accumulate(trigger_times)
+        self.trigger_time = trigger_times[-1]
+        self.prev_gate = bool(gate[-1])
+        if not self._valid:
+            return {"envelope": np.zeros(len(t))}
+        a,d,s,r = self._a, self._d, self._s, self._r
+        progress = t - trigger_times
+        # one binary search for the stage of every sample, then choose picks the matching
+        # lane - same selection the nested wheres did but without four full-block compares
+        stage = np.searchsorted(self._bounds, progress, side = "right")
+        with np.errstate(divide = "ignore", invalid = "ignore"): # zero-length stages, like the scalar branches just skip
+            v = np.choose(stage, [progress/a, 1 - (0.5*((progress - a)/d)), 0.5,
+                                  0.5 - (0.5*((progress - (a+d+s))/r)), 0.])
         return {"envelope": v}
 
+# shared stand-in for "no image loaded" - surfaces are sdl allocations, so don't make a
+# fresh one per instance or per failed load while a filename is being typed
+_placeholder_image = pygame.Surface((1,1))
 def image_visualiser(surface, inputs, outputs, module):
+    # rescaling the full image every frame is wasted work when neither it nor the widget size
+    # change - memoize on both, and use smoothscale since it only runs on cache misses now
     _,_,w,h = module.visualiser.get_rect()
-    return pygame.transform.scale(module.image, (w,h))
+    key = (id(module.image), int(w), int(h))
+    if module._scaled_key != key:
+        module._scaled = pygame.transform.smoothscale(module.image, (int(w), int(h)))
+        module._scaled_key = key
+    return module._scaled
 class ImageIn(VisualModule):
     name = "Image Input"
     inputs = {"x": (float, 0.), "y": (float, 0.)}
@@ -722,28 +1331,58 @@ class ImageIn(VisualModule):
     settings = {"filename": ("text", "<filename>")}
     visualiser = ("image", (100,100), image_visualiser)
     image = None
+    _scaled_key = None
+    _scaled = None
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.image = pygame.Surface((1,1))
+        self.image = _placeholder_image
+        self._refresh_pixels()
+    def _refresh_pixels(self):
+        # one numpy copy of the image, already scaled to the -1..1 signal range - sampling is
+        # then an array index instead of a per-sample get_at (which allocates a Color and
+        # crosses into sdl every call)
+        self._px = (pygame.surfarray.array3d(self.image).astype(np.float32) / 127.5) - 1.
+        self._w, self._h = self.image.get_size()
+        # precomputed scale and clamp bounds so f() is just a multiply, a cast and two compares
+        self._w_half, self._h_half = self._w / 2, self._h / 2
+        self._wm1, self._hm1 = self._w - 1, self._h - 1
     def f(self, t, x, y):
-        w,h = self.image.get_size()
-        r,g,b,_ = self.image.get_at((min(math.floor(((x/2)+0.5)*w), w-1), min(math.floor(((y/2)+0.5)*h), h-1)))
-        r = ((r/255)*2)-1
-        g = ((g/255)*2)-1
-        b = ((b/255)*2)-1
+        # int() truncates where floor rounds down, but anything that differs is negative and
+        # gets clamped to 0 anyway (the old code let x < -1 wrap round via negative indexing)
+        ix = int((x + 1.) * self._w_half)
+        ix = self._wm1 if ix > self._wm1 else (0 if ix < 0 else ix)
+        iy = int((y + 1.) * self._h_half)
+        iy = self._hm1 if iy > self._hm1 else (0 if iy < 0 else iy)
+        r,g,b = self._px[ix, iy]
         return {"r": r, "g": g, "b": b}
+    def f_block(self, t, x, y):
+        # one gather over the cached pixel array for the whole block - same maths as f,
+        # astype truncates like int() does and clip matches the scalar clamps
+        x = np.broadcast_to(np.asarray(x, dtype = float), t.shape)
+        y = np.broadcast_to(np.asarray(y, dtype = float), t.shape)
+        ix = ((x + 1.) * self._w_half).astype(np.int64)
+        np.clip(ix, 0, self._wm1, out = ix)
+        iy = ((y + 1.) * self._h_half).astype(np.int64)
+        np.clip(iy, 0, self._hm1, out = iy)
+        rgb = self._px[ix, iy]
+        return {"r": rgb[:,0], "g": rgb[:,1], "b": rgb[:,2]}
     def setting_changed(self):
+        super().setting_changed()
         try:
             self.image = pygame.image.load(self.settings["filename"].value)
+            if pygame.display.get_surface() is not None:
+                self.image = self.image.convert() # blitted every frame, so match the display format
             self.visualiser.aspect_ratio = self.image.get_size()
         except:
-            self.image = pygame.Surface((1,1))
+            self.image = _placeholder_image
+        self._refresh_pixels()
         
         
             
 
-synth = VisualSynth(library = [Osc, Constant, Add, Multiply, EvalExpr, Threshold, Choice, ADSR, PathGen, VideoOut, ImageIn], rate = 100000)
-window(synth, 30)
+if __name__ == "__main__":
+    synth = VisualSynth(library = [Osc, Constant, Add, Multiply, EvalExpr, Threshold, Choice, ADSR, PathGen, VideoOut, ImageIn], rate = 100000)
+    window(synth, 30)
 
 
 